@@ -4,13 +4,17 @@ Integrates YOLO detection + ByteTrack + LineCounter
 Processes video and creates output with car counting visualization
 """
 
-# pip install ultralytics opencv-python numpy
+# pip install ultralytics opencv-python numpy numba
 
 import cv2
 import time
+import numpy as np
+import torch
+import queue
+import threading
 from pathlib import Path
 from ultralytics import YOLO
-from line_counter import LineCounter, Geometry
+from line_counter import LineCounter
 
 print("="*70)
 print("CAR COUNTER SYSTEM")
@@ -40,6 +44,10 @@ YOLO_MODEL = "yolov8n.pt"  # Autoloaded model file when run
 # test using yolov8n.pt model (small, fast, stable)
 # lastest yolo11n.pt (~3% more accurate, ~10% faster processing, might have undiscovered bug)
 CONFIDENCE_THRESHOLD = 0.3 # Detection confidence range(0.0 to 1.0) # use 0.3 when video test
+BATCH_SIZE = 8  # Frames sent to YOLO per call (8-16 keeps the GPU busy, lower if out of memory)
+USE_TENSORRT = True  # NVIDIA GPU only: export to TensorRT FP16 once, reuse the .engine file after (~2x faster)
+INFERENCE_SIZE = 640  # YOLO input size, frames are shrunk to this once before detection
+USE_GPU_PREPROCESS = True  # NVIDIA GPU only: convert frames to YOLO input (float, RGB, 0-1) on GPU
 
 # Detection confidence Selection Rules
 """
@@ -56,7 +64,11 @@ Example: ignore small or blurry cars bc it's not 95% sure
 
 # Display settings
 SHOW_LIVE_PREVIEW = False  # Set True to see processing in real-time (slower)
+DRAW_OVERLAY = True  # Semi-transparent info panel (False = solid black panel, faster for headless runs)
 SKIP_FRAMES = 1  # Process every N frames (1 = every frame, 2 = every other frame)
+QUEUE_SIZE = 8  # Max frames buffered between reader -> model -> writer threads
+USE_HW_DECODE = True  # NVIDIA GPU + OpenCV built with GStreamer: decode H.264 video on GPU (NVDEC)
+USE_HW_ENCODE = True  # NVIDIA GPU + OpenCV built with GStreamer: encode output on GPU (NVENC)
 
 print(f"\no Input video: {INPUT_VIDEO}")
 print(f"o Output will be saved to: {OUTPUT_DIR}/{OUTPUT_VIDEO}")
@@ -66,9 +78,25 @@ print(f"o Output will be saved to: {OUTPUT_DIR}/{OUTPUT_VIDEO}")
 # ============================================================================
 
 print("\n[1/4] Loading YOLO model...")
+model_file = YOLO_MODEL
+if USE_TENSORRT and torch.cuda.is_available():
+    # Engine only works for the batch/input size it was built with, so both are in the
+    # file name (eg. yolov8n_b8_640.engine). Delete the file to rebuild it for a new GPU
+    model_path = Path(YOLO_MODEL)
+    engine_file = model_path.with_name(f"{model_path.stem}_b{BATCH_SIZE}_{INFERENCE_SIZE}.engine")
+    try:
+        if not engine_file.exists():
+            print(f"- Exporting {YOLO_MODEL} to TensorRT FP16 (first run only, takes a few minutes)...")
+            exported = YOLO(YOLO_MODEL).export(format="engine", half=True, dynamic=True, 
+                                            batch=BATCH_SIZE, imgsz=INFERENCE_SIZE)
+            Path(exported).replace(engine_file)
+        model_file = str(engine_file)
+    except Exception as e:
+        print(f"- TensorRT export failed ({e}), using {YOLO_MODEL}")
+
 try:
-    model = YOLO(YOLO_MODEL)
-    print(f"- Model loaded: {YOLO_MODEL}")
+    model = YOLO(model_file)
+    print(f"- Model loaded: {model_file}")
     print(f"- Confidence Threshold = {CONFIDENCE_THRESHOLD}")
 except Exception as e:
     print(f"- Error loading model: {e}")
@@ -86,12 +114,27 @@ if not cap.isOpened():
 # Get video properties
 frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
 frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-fps = int(cap.get(cv2.CAP_PROP_FPS))
+fps = cap.get(cv2.CAP_PROP_FPS)  # keep float (29.97 etc.) so video time stays exact
 total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
-print(f"- Video opened: {frame_width}x{frame_height} @ {fps}fps")
+print(f"- Video opened: {frame_width}x{frame_height} @ {fps:.2f}fps")
 print(f"- Total frames: {total_frames} (~{total_frames/fps:.1f} seconds)")
 
+# Switch to GPU decode if available (properties above come from the normal reader,
+# GStreamer does not always report frame count)
+if USE_HW_DECODE and torch.cuda.is_available():
+    gst_pipeline = (f'filesrc location="{INPUT_VIDEO}" ! qtdemux ! h264parse ! nvh264dec ! '
+                    "videoconvert ! video/x-raw,format=BGR ! appsink")
+    hw_cap = cv2.VideoCapture(gst_pipeline, cv2.CAP_GSTREAMER)
+    if hw_cap.isOpened():
+        cap.release()
+        cap = hw_cap
+        print("- Decoding on GPU (NVDEC)")
+    else:
+        print("- GPU decode not available, using normal decode")
+
+cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Only hold the latest frame (no-op for files, less lag for live cameras)
+
 # Calculate actual line position
 line_x1 = int(LINE_POSITION[0] * frame_width)
 line_y1 = int(LINE_POSITION[1] * frame_height)
@@ -106,13 +149,124 @@ counter = LineCounter(
 )
 print(f"- Counting line set from ({line_x1},{line_y1}) to ({line_x2},{line_y2})")
 
+# Info panel at (10,10)-(400,150): static labels are rendered once here,
+# each frame only blends the panel area and draws the numbers
+# (putText anti-aliases, so labels are blended by their coverage, not a hard mask)
+panel_lines = [
+    # (label, y, font scale, color)
+    ("Cars IN:  ", 35, 0.7, (0, 255, 0)),
+    ("Cars OUT: ", 65, 0.7, (0, 255, 255)),
+    ("TOTAL:    ", 95, 0.7, (255, 255, 255)),
+    ("Detected: ", 125, 0.6, (200, 200, 200)),
+]
+panel_y2 = min(151, frame_height)  # clip panel for small videos
+panel_x2 = min(401, frame_width)
+panel_bg = np.zeros((141, 391, 3), dtype=np.uint8)
+panel_cov = np.zeros((141, 391), dtype=np.uint8)  # label coverage, 255 = fully covered
+number_x = []
+for label, y, scale, color in panel_lines:
+    cv2.putText(panel_bg, label, (10, y - 10), cv2.FONT_HERSHEY_SIMPLEX, scale, color, 2)
+    cv2.putText(panel_cov, label, (10, y - 10), cv2.FONT_HERSHEY_SIMPLEX, scale, 255, 2)
+    (label_w, _), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, scale, 2)
+    number_x.append(20 + label_w - 1)  # same x as the number had in the full "label + number" string
+panel_bg = panel_bg[:panel_y2 - 10, :panel_x2 - 10]
+panel_cov = panel_cov[:panel_y2 - 10, :panel_x2 - 10]
+# Per pixel: panel = video * keep + coverage * color, keep = 0.4 (same as 60% black blend) fading to 0 under a label.
+# cv2.blendLinear weights the label image by (1 - keep), so it is stored divided by that
+panel_keep = (0.4 * (1.0 - panel_cov / 255.0)).astype(np.float32)
+panel_label_w = 1.0 - panel_keep
+panel_label = np.clip(panel_bg / panel_label_w[..., None] + 0.5, 0, 255).astype(np.uint8)
+
+# YOLO input frames: shrink long side to INFERENCE_SIZE (never enlarge), then pad
+# bottom/right to a multiple of 32 so YOLO doesn't need to resize or letterbox again
+inference_scale = min(1.0, INFERENCE_SIZE / max(frame_width, frame_height))
+small_width = round(frame_width * inference_scale)
+small_height = round(frame_height * inference_scale)
+pad_bottom = -small_height % 32
+pad_right = -small_width % 32
+
+# Scale detected boxes from small frame back to original frame
+box_scale = np.array([frame_width / small_width, frame_height / small_height] * 2, dtype=np.float32)
+
+def shrink_frame(frame):
+    # Resize + pad one frame for YOLO
+    if inference_scale < 1.0:
+        frame = cv2.resize(frame, (small_width, small_height), interpolation=cv2.INTER_LINEAR)
+    if pad_bottom or pad_right:
+        frame = cv2.copyMakeBorder(frame, 0, pad_bottom, 0, pad_right, 
+                                cv2.BORDER_CONSTANT, value=(114, 114, 114))  # YOLO letterbox gray
+    return frame
+
+# Reusable pinned (page-locked) CPU buffer + GPU buffer for one batch of YOLO input,
+# so the CPU only copies bytes and the float conversion happens on GPU
+use_gpu_preprocess = USE_GPU_PREPROCESS and torch.cuda.is_available()
+if use_gpu_preprocess:
+    host_buf = torch.empty((BATCH_SIZE, 3, small_height + pad_bottom, small_width + pad_right), 
+                        dtype=torch.uint8, pin_memory=True)
+    dev_buf = torch.empty_like(host_buf, device='cuda')
+    copy_done = torch.cuda.Event()  # host_buf can be refilled once this copy has finished
+
 # Create output directory
 Path(OUTPUT_DIR).mkdir(exist_ok=True)
 
 # Initialize video writer
 output_path = Path(OUTPUT_DIR) / OUTPUT_VIDEO
-fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-out = cv2.VideoWriter(str(output_path), fourcc, fps, (frame_width, frame_height))
+out = None
+
+# Encode on GPU (NVENC) if available, keeps the writer thread from becoming the bottleneck
+if USE_HW_ENCODE and torch.cuda.is_available():
+    gst_pipeline = (f"appsrc ! videoconvert ! nvh264enc ! h264parse ! qtmux ! "
+                    f'filesink location="{output_path}"')
+    out = cv2.VideoWriter(gst_pipeline, cv2.CAP_GSTREAMER, 0, fps, (frame_width, frame_height), True)
+    if out.isOpened():
+        print("- Encoding on GPU (NVENC)")
+
+# Otherwise H.264 (avc1), or MPEG-4 (mp4v) if OpenCV has no H.264 encoder
+if out is None or not out.isOpened():
+    for codec in ('avc1', 'mp4v'):
+        fourcc = cv2.VideoWriter_fourcc(*codec)
+        out = cv2.VideoWriter(str(output_path), fourcc, fps, (frame_width, frame_height))
+        if out.isOpened():
+            print(f"- Encoding with {codec}")
+            break
+
+# ============================================================================
+# READER / WRITER THREADS
+# ============================================================================
+
+"""
+Pipeline: reader thread -> main thread (YOLO + counter + drawing) -> writer thread
+While frame N is in YOLO, frame N+1 is decoding and frame N-1 is encoding
+The counter only lives in the main thread, so no locking is needed
+"""
+read_q = queue.Queue(maxsize=QUEUE_SIZE)   # (frame_idx, frame, small frame), None = end of video
+write_q = queue.Queue(maxsize=QUEUE_SIZE)  # annotated frame, None = stop writer
+stop_event = threading.Event()
+
+def read_frames():
+    # Decode (and shrink) frames ahead of the model
+    frame_idx = 0
+    while not stop_event.is_set():
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_idx += 1
+        
+        # Only frames that will be processed need a YOLO-sized copy
+        small = shrink_frame(frame) if frame_idx % SKIP_FRAMES == 0 else None
+        read_q.put((frame_idx, frame, small))
+    read_q.put(None)
+
+def write_frames():
+    # Encode annotated frames behind the model
+    while True:
+        frame = write_q.get()
+        if frame is None:
+            break
+        out.write(frame)
+
+reader = threading.Thread(target=read_frames, daemon=True)
+writer = threading.Thread(target=write_frames, daemon=True)
 
 print(f"\n[4/4] Starting video processing...")
 print("="*70)
@@ -121,144 +275,209 @@ print("="*70)
 # MAIN PROCESSING LOOP
 # ============================================================================
 
-frame_count = 0
 processed_count = 0
 start_time = time.time()
+stopped = False
+end_of_video = False
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
-    
-    frame_count += 1
+reader.start()
+writer.start()
+
+# Frames waiting for the next batched YOLO call
+batch_frames = []
+batch_small = []
+batch_indices = []
+batch_times = []
+batch_repeats = []  # skipped frames after each one, written as copies of it
+
+# Skipped frames reuse the last annotated frame so the output keeps the input frame rate
+last_annotated = None
+
+while not stopped:
+    item = read_q.get()
+    end_of_video = item is None
     
-    # Skip frames if configured
-    if frame_count % SKIP_FRAMES != 0:
-        continue
+    if not end_of_video:
+        frame_idx, frame, small = item
+        
+        # Skip frames if configured
+        if frame_idx % SKIP_FRAMES != 0:
+            if batch_frames:
+                batch_repeats[-1] += 1  # write after that frame is annotated
+            else:
+                write_q.put(last_annotated if last_annotated is not None else frame)
+            continue
+        
+        if use_gpu_preprocess:
+            # Wait for the previous batch's copy out of host_buf before overwriting it
+            copy_done.synchronize()
+            
+            # Stage straight into pinned memory (HWC -> CHW, still BGR uint8)
+            host_buf[len(batch_small)].copy_(torch.from_numpy(small).permute(2, 0, 1))
+        
+        batch_frames.append(frame)
+        batch_small.append(small)
+        batch_indices.append(frame_idx)
+        batch_times.append(frame_idx / fps)  # video time, so cooldown doesn't depend on processing speed
+        batch_repeats.append(0)
+        
+        # Keep reading until the batch is full
+        if len(batch_frames) < BATCH_SIZE:
+            continue
     
-    processed_count += 1
-    current_time = time.time()
+    # End of video with nothing left to flush
+    if not batch_frames:
+        break
     
     # ========================================================================
     # YOLO DETECTION
     # ========================================================================
     
-    # Run YOLO detection with tracking
+    if use_gpu_preprocess:
+        # Async copy to GPU, then BGR -> RGB and uint8 -> float 0-1 on GPU
+        n = len(batch_small)
+        dev_buf[:n].copy_(host_buf[:n], non_blocking=True)
+        copy_done.record()
+        yolo_input = dev_buf[:n, [2, 1, 0]].float().div_(255)
+    else:
+        yolo_input = batch_small
+    
+    # Run YOLO detection with tracking on the whole batch at once
+    # Frames are passed in video order, so ByteTrack IDs survive across batches
     results = model.track(
-        frame, 
+        yolo_input,  # already shrunk to YOLO input size
+        imgsz=INFERENCE_SIZE,
         persist=True,  # Enable tracking
         conf=CONFIDENCE_THRESHOLD,
         classes=[2, 3, 5, 7],  # car=2, motorcycle=3, bus=5, truck=7
         verbose=False
     )
     
-    # ========================================================================
-    # PROCESS DETECTIONS
-    # ========================================================================
-    
-    detections = results[0].boxes
-    detected_count = 0
-    
-    if detections is not None and len(detections) > 0:
-        for detection in detections:
-            # Get bounding box
-            bbox = detection.xyxy[0].cpu().numpy()  # [x1, y1, x2, y2]
-            x1, y1, x2, y2 = map(int, bbox)
+    for frame, frame_idx, video_time, repeats, result in zip(batch_frames, batch_indices, 
+                                                            batch_times, batch_repeats, results):
+        processed_count += 1
+        
+        # ====================================================================
+        # PROCESS DETECTIONS
+        # ====================================================================
+        
+        detections = result.boxes
+        detected_count = 0
+        
+        # Skip if no track IDs (ByteTrack gives IDs to all boxes or none)
+        if detections is not None and detections.id is not None:
+            # Copy all boxes and IDs off the GPU at once (one sync per frame, not per car)
+            boxes = detections.xyxy.cpu().numpy() * box_scale  # [[x1, y1, x2, y2], ...] in original frame
+            track_ids = detections.id.cpu().numpy().astype(np.int32)
             
-            # Get track ID (from ByteTrack built into YOLO)
-            if detection.id is not None:
-                track_id = int(detection.id.cpu().numpy()[0])
-            else:
-                continue  # Skip if no track ID
-            
-            # Calculate centroid
-            centroid = Geometry.centroid_xyxy(bbox)
-            
-            # Update counter
-            crossed = counter.update(track_id, centroid, current_time)
-            
-            # ================================================================
-            # DRAW VISUALIZATION
-            # ================================================================
+            # Calculate all centroids at once
+            centroids = (boxes[:, :2] + boxes[:, 2:]) * 0.5  # [[cx, cy], ...]
             
-            # Draw bounding box
-            color = (0, 255, 0) if not crossed else (0, 255, 255)  # Green or yellow if just crossed
-            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+            # Update counter with every car in the frame
+            crossed_all = counter.update_batch(track_ids, centroids, video_time)
             
-            # Draw track ID
-            label = f"ID:{track_id}"
-            cv2.putText(frame, label, (x1, y1-10), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-            
-            # Draw centroid
-            cx, cy = map(int, centroid)
-            cv2.circle(frame, (cx, cy), 4, (255, 0, 0), -1)
-            
-            detected_count += 1
-    
-    # ========================================================================
-    # DRAW UI OVERLAY
-    # ========================================================================
-    
-    # Draw counting line
-    cv2.line(frame, (line_x1, line_y1), (line_x2, line_y2), 
-            (0, 0, 255), 3)  # Red line
-    
-    # Draw semi-transparent info panel
-    overlay = frame.copy()
-    cv2.rectangle(overlay, (10, 10), (400, 150), (0, 0, 0), -1)
-    cv2.addWeighted(overlay, 0.6, frame, 0.4, 0, frame)
-    
-    # Draw statistics
-    stats = counter.get_statistics()
-    
-    y_offset = 35
-    cv2.putText(frame, f"Cars IN:  {stats['count_in']}", 
-                (20, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+            for bbox, track_id, centroid, crossed in zip(boxes.astype(np.int32).tolist(), 
+                                                        track_ids.tolist(), centroids.tolist(), 
+                                                        crossed_all.tolist()):
+                x1, y1, x2, y2 = bbox
+                
+                # ============================================================
+                # DRAW VISUALIZATION
+                # ============================================================
+                
+                # Draw bounding box
+                color = (0, 255, 0) if not crossed else (0, 255, 255)  # Green or yellow if just crossed
+                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+                
+                # Draw track ID
+                label = f"ID:{track_id}"
+                cv2.putText(frame, label, (x1, y1-10), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+                
+                # Draw centroid
+                cx, cy = map(int, centroid)
+                cv2.circle(frame, (cx, cy), 4, (255, 0, 0), -1)
+                
+                detected_count += 1
+        
+        # ====================================================================
+        # DRAW UI OVERLAY
+        # ====================================================================
+        
+        # Draw counting line
+        cv2.line(frame, (line_x1, line_y1), (line_x2, line_y2), 
+                (0, 0, 255), 3)  # Red line
+        
+        # Draw info panel with cached labels (darken only the panel area, blending labels in by coverage)
+        panel = frame[10:panel_y2, 10:panel_x2]
+        if DRAW_OVERLAY:
+            cv2.blendLinear(panel, panel_label, panel_keep, panel_label_w, dst=panel)
+        else:
+            panel[:] = panel_bg  # solid black panel: plain copy, no blend
+        
+        # Draw statistics (numbers only), clock advances on every frame, cars or not
+        counter.set_time(video_time)
+        stats = counter.get_statistics()
+        values = (stats['count_in'], stats['count_out'], stats['total'], detected_count)
+        
+        for (label, y, scale, color), x, value in zip(panel_lines, number_x, values):
+            cv2.putText(frame, str(value), (x, y), cv2.FONT_HERSHEY_SIMPLEX, scale, color, 2)
+        
+        # ====================================================================
+        # WRITE OUTPUT & DISPLAY
+        # ====================================================================
+        
+        # Hand frame to the writer thread (plus copies for the skipped frames after it)
+        for _ in range(1 + repeats):
+            write_q.put(frame)
+        last_annotated = frame
+        
+        # Show live preview if enabled
+        if SHOW_LIVE_PREVIEW:
+            cv2.imshow('Car Counter', frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                print("\n⚠️  Stopped by user")
+                stopped = True
+                break
+        
+        # Print progress
+        if processed_count % 30 == 0:
+            progress = (frame_idx / total_frames) * 100
+            elapsed = time.time() - start_time
+            processing_fps = processed_count / elapsed
+            print(f"Frame {frame_idx}/{total_frames} ({progress:.1f}%) | "
+                f"Detected: {detected_count} | Total counted: {stats['total']} | "
+                f"FPS: {processing_fps:.1f}")
+        
+        # Cleanup old tracks periodically
+        if frame_idx % 100 == 0:
+            counter.cleanup_old_tracks(video_time)
     
-    y_offset += 30
-    cv2.putText(frame, f"Cars OUT: {stats['count_out']}", 
-                (20, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+    batch_frames = []
+    batch_small = []
+    batch_indices = []
+    batch_times = []
+    batch_repeats = []
     
-    y_offset += 30
-    cv2.putText(frame, f"TOTAL:    {stats['total']}", 
-                (20, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-    
-    y_offset += 30
-    cv2.putText(frame, f"Detected: {detected_count}", 
-                (20, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 2)
-    
-    # ========================================================================
-    # WRITE OUTPUT & DISPLAY
-    # ========================================================================
-    
-    # Write frame to output video
-    out.write(frame)
-    
-    # Show live preview if enabled
-    if SHOW_LIVE_PREVIEW:
-        cv2.imshow('Car Counter', frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            print("\n⚠️  Stopped by user")
-            break
-    
-    # Print progress
-    if processed_count % 30 == 0:
-        progress = (frame_count / total_frames) * 100
-        elapsed = time.time() - start_time
-        processing_fps = processed_count / elapsed
-        print(f"Frame {frame_count}/{total_frames} ({progress:.1f}%) | "
-            f"Detected: {detected_count} | Total counted: {stats['total']} | "
-            f"FPS: {processing_fps:.1f}")
-    
-    # Cleanup old tracks periodically
-    if frame_count % 100 == 0:
-        counter.cleanup_old_tracks(current_time)
+    # Last partial batch has been flushed
+    if end_of_video:
+        break
 
 # ============================================================================
 # CLEANUP & FINAL STATISTICS
 # ============================================================================
 
+# Stopped early - unblock the reader so it can exit
+if not end_of_video:
+    stop_event.set()
+    while read_q.get() is not None:
+        pass
+
+# Let the writer finish encoding queued frames
+write_q.put(None)
+reader.join()
+writer.join()
+
 cap.release()
 out.release()
 cv2.destroyAllWindows()
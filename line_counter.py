@@ -3,8 +3,53 @@ LineCounter Module - Traffic Car Counting System
 \nThis is the core counting logic
 """
 
-import time
-from typing import Tuple, Dict
+import numpy as np
+from numba import njit
+from typing import Tuple, Dict, List
+
+_INF = float('inf')  # last time of a free / new slot
+
+
+@njit(cache=True)
+def _count_crossings(slots, centroids, A, B, C, sides, last, timestamp, cooldown, crossed):
+    """
+    Counting loop for one frame, compiled by numba so it runs without
+    Python overhead per car
+    
+    New slots have last = inf. Updates sides/last in place, marks crossed,
+    returns (count_in, count_out) added by this frame
+    """
+    count_in = 0
+    count_out = 0
+    
+    for i in range(len(slots)):
+        slot = slots[i]
+        current_side = A * centroids[i, 0] + B * centroids[i, 1] + C
+        previous_side = sides[slot]
+        sides[slot] = current_side
+        
+        # First time seeing this car
+        if last[slot] == np.inf:
+            last[slot] = timestamp
+            continue
+        
+        # Check cooldown
+        if timestamp - last[slot] < cooldown:
+            continue
+        
+        # Crossing and direction in one step (same as Geometry.cross_direction):
+        # sign of previous side when the signs are opposite, else 0
+        s = int(previous_side > 0) - int(previous_side < 0)
+        c = int(current_side > 0) - int(current_side < 0)
+        direction = s * int(s * c < 0)
+        count_in += direction > 0
+        count_out += direction < 0
+        
+        if direction != 0:
+            last[slot] = timestamp
+            crossed[i] = True
+    
+    return count_in, count_out
 
 
 class Geometry:
@@ -40,12 +85,26 @@ class Geometry:
             return -1
         return 0
     
+    @staticmethod
+    def cross_direction(previous_side: float, current_side: float) -> int:
+        """
+        Check crossing and direction at once
+        Returns: +1 for one direction, -1 for opposite, 0 for no crossing
+        """
+        # sign(previous) when the signs are opposite, else 0 (no branches)
+        s = int(previous_side > 0) - int(previous_side < 0)
+        c = int(current_side > 0) - int(current_side < 0)
+        return s * int(s * c < 0)
+    
     @staticmethod
     def centroid_xyxy(bbox: Tuple[float, float, float, float]) -> Tuple[float, float]:
         """
         Calculate center point of bounding box
         bbox format: (x1, y1, x2, y2)
         Returns: (cx, cy)
+        
+        Fallback for a single box, for many boxes use
+        (xyxy[:, :2] + xyxy[:, 2:]) * 0.5 on the whole array
         """
         x1, y1, x2, y2 = bbox
         cx = (x1 + x2) / 2.0
@@ -59,6 +118,9 @@ class LineCounter:
     Counts vehicles crossing a virtual line with direction tracking
     """
     
+    # Starting number of track slots (arrays double when full)
+    INITIAL_CAPACITY = 1024
+    
     def __init__(self, 
                 line_start: Tuple[float, float],
                 line_end: Tuple[float, float],
@@ -70,24 +132,36 @@ class LineCounter:
             line_start: (x, y) start point of counting line
             line_end: (x, y) end point of counting line
             cooldown: seconds to wait before counting same car again
+        
+        Timestamps are video time in seconds (eg. frame_idx / fps),
+        so counting gives the same result however fast the video is processed
         """
         self.line_start = line_start
         self.line_end = line_end
         self.cooldown = cooldown
         
+        # Line as A*x + B*y + C (same sign as Geometry.line_side), computed once
+        # since the line never moves, used by the compiled counting loop
+        x1, y1 = line_start
+        x2, y2 = line_end
+        self._A = float(y1 - y2)
+        self._B = float(x2 - x1)
+        self._C = float(x1 * y2 - x2 * y1)
+        
         # Count variables
         self.count_in = 0
         self.count_out = 0
         
-        # Track each car state
-        self.tracked_objects: Dict[int, Dict] = {}
+        # Track each car state as parallel arrays indexed by slot
+        self._init_tracks(self.INITIAL_CAPACITY)
         
         # Geometry helper
         self.geometry = Geometry()
         
         # Statistics
         self.total_crossed = 0
-        self.start_time = time.time()
+        self.start_time = 0.0  # video time counting started (start of video or reset)
+        self.latest_time = 0.0  # latest video time seen
     
     def update(self, 
             track_id: int, 
@@ -99,56 +173,127 @@ class LineCounter:
         Args:
             track_id: Unique ID for the car
             centroid: (x, y) center position of car
-            timestamp: Current time in seconds
+            timestamp: Video time in seconds
             
         Returns:
             bool: True if this car just crossed the line
         """
-        # Calculate which side of line the car is on
-        current_side = self.geometry.line_side(centroid, self.line_start, self.line_end)
+        self.set_time(timestamp)
+        
+        # Get this car's slot, give a new car a free one
+        slot = self._slot_of.get(track_id)
+        if slot is None:
+            slot = self._new_slot(track_id)
+        
+        # Calculate which side of line the car is on (side always moves to the current position)
+        x, y = centroid
+        current_side = self._A * x + self._B * y + self._C
+        sides = self._sides
+        previous_side = sides.item(slot)  # .item() gives a Python float, faster math than NumPy scalars
+        sides[slot] = current_side
         
         # First time seeing this car
-        if track_id not in self.tracked_objects:
-            self.tracked_objects[track_id] = {
-                'side': current_side,
-                'last_time': timestamp
-            }
+        last = self._last
+        last_time = last.item(slot)
+        if last_time == _INF:
+            last[slot] = timestamp
             return False
         
-        # Get previous state
-        previous_state = self.tracked_objects[track_id]
-        previous_side = previous_state['side']
-        last_time = previous_state['last_time']
-        
         # Check cooldown
-        time_since_last = timestamp - last_time
-        if time_since_last < self.cooldown:
-            self.tracked_objects[track_id]['side'] = current_side
+        if timestamp - last_time < self.cooldown:
             return False
         
-        # Check if car crossed the line
-        if self.geometry.crossed(previous_side, current_side):
-            direction = self.geometry.direction_sign(previous_side, current_side)
-            
-            if direction > 0:
+        # Check if car crossed the line (sides have different signs)
+        if previous_side * current_side < 0:
+            if previous_side > 0:
                 self.count_in += 1
-            elif direction < 0:
+            else:
                 self.count_out += 1
             
             self.total_crossed += 1
-            
-            # Update tracking state
-            self.tracked_objects[track_id] = {
-                'side': current_side,
-                'last_time': timestamp
-            }
-            
+            last[slot] = timestamp
             return True
         
-        # No crossing - just update position
-        self.tracked_objects[track_id]['side'] = current_side
         return False
     
+    def update_batch(self, 
+                    track_ids: np.ndarray, 
+                    centroids: np.ndarray, 
+                    timestamp: float) -> np.ndarray:
+        """
+        Update counter with all car positions from one frame
+        
+        Args:
+            track_ids: (N,) unique IDs for the cars
+            centroids: (N, 2) center positions of cars
+            timestamp: Video time in seconds
+            
+        Returns:
+            np.ndarray: (N,) bool, True where that car just crossed the line
+        """
+        self.set_time(timestamp)
+        
+        # Look up every car's slot, give new cars a free one
+        ids = track_ids.tolist()
+        slot_of = self._slot_of
+        slots = [slot_of.get(track_id) for track_id in ids]
+        if None in slots:
+            for i, track_id in enumerate(ids):
+                if slots[i] is None:
+                    # Same new ID twice in one frame gets one slot
+                    slot = slot_of.get(track_id)
+                    slots[i] = slot if slot is not None else self._new_slot(track_id)
+        
+        # Sides, cooldown and crossings for the whole frame in one compiled call
+        crossed = np.zeros(len(ids), dtype=np.bool_)
+        count_in, count_out = _count_crossings(
+            np.array(slots, dtype=np.int64), centroids, self._A, self._B, self._C, 
+            self._sides, self._last, float(timestamp), float(self.cooldown), crossed
+        )
+        
+        self.count_in += count_in
+        self.count_out += count_out
+        self.total_crossed += count_in + count_out
+        return crossed
+    
+    def set_time(self, timestamp: float):
+        # Advance the video clock (call every processed frame, even with no cars)
+        if self.start_time is None:
+            self.start_time = timestamp
+            self.latest_time = timestamp
+        elif timestamp > self.latest_time:
+            self.latest_time = timestamp
+    
+    def _init_tracks(self, capacity: int):
+        # Allocate empty track arrays
+        self._slot_of: Dict[int, int] = {}                           # track_id -> slot
+        self._track_of = np.full(capacity, -1, dtype=np.int64)       # slot -> track_id
+        self._sides = np.zeros(capacity, dtype=np.float64)           # line side per slot
+        self._last = np.full(capacity, np.inf, dtype=np.float64)     # inf = free slot, never stale
+        self._free_slots: List[int] = list(range(capacity - 1, -1, -1))
+    
+    def _new_slot(self, track_id: int) -> int:
+        # Give a new car a free slot, doubling the arrays if all are used
+        if not self._free_slots:
+            capacity = len(self._last)
+            self._track_of = np.concatenate([self._track_of, np.full(capacity, -1, dtype=np.int64)])
+            self._sides = np.concatenate([self._sides, np.zeros(capacity, dtype=np.float64)])
+            self._last = np.concatenate([self._last, np.full(capacity, np.inf, dtype=np.float64)])
+            self._free_slots = list(range(2 * capacity - 1, capacity - 1, -1))
+        
+        slot = self._free_slots.pop()
+        self._slot_of[track_id] = slot
+        self._track_of[slot] = track_id
+        return slot
+    
+    @property
+    def tracked_objects(self) -> Dict[int, Dict]:
+        # Snapshot of each car state as {track_id: {'side', 'last_time'}}
+        return {
+            track_id: {'side': float(self._sides[slot]), 'last_time': float(self._last[slot])}
+            for track_id, slot in self._slot_of.items()
+        }
+    
     @property
     def total_count(self) -> int:
         # Get total number of cars counted
@@ -160,7 +305,7 @@ class LineCounter:
     
     def get_statistics(self) -> Dict:
         # Get all counting statistics
-        elapsed_time = time.time() - self.start_time
+        elapsed_time = self.latest_time - self.start_time if self.start_time is not None else 0.0
         
         return {
             'count_in': self.count_in,
@@ -168,25 +313,26 @@ class LineCounter:
             'total': self.total_count,
             'elapsed_time': elapsed_time,
             'cars_per_minute': (self.total_count / elapsed_time * 60) if elapsed_time > 0 else 0,
-            'active_tracks': len(self.tracked_objects)
+            'active_tracks': len(self._slot_of)
         }
     
-    def reset(self):
-        # Reset all counts to zero
+    def reset(self, timestamp: float = None):
+        # Reset all counts to zero, elapsed time restarts at timestamp (or the next time seen)
         self.count_in = 0
         self.count_out = 0
         self.total_crossed = 0
-        self.tracked_objects.clear()
-        self.start_time = time.time()
+        self._init_tracks(self.INITIAL_CAPACITY)
+        self.start_time = timestamp
+        self.latest_time = timestamp
     
     def cleanup_old_tracks(self, current_time: float, max_age: float = 5.0):
         # Remove tracks that haven't been updated recently
-        tracks_to_remove = []
+        stale = np.flatnonzero(current_time - self._last > max_age)
         
-        for track_id, state in self.tracked_objects.items():
-            age = current_time - state['last_time']
-            if age > max_age:
-                tracks_to_remove.append(track_id)
+        for track_id in self._track_of[stale].tolist():
+            del self._slot_of[track_id]
         
-        for track_id in tracks_to_remove:
-            del self.tracked_objects[track_id]
\ No newline at end of file
+        # Free the slots for new cars
+        self._track_of[stale] = -1
+        self._last[stale] = np.inf
+        self._free_slots.extend(stale.tolist())
\ No newline at end of file